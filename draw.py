@@ -1,107 +1,154 @@
 import cairo
 import hashlib
+import functools
+import math
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from typing import Dict, Any, TypedDict
-from typing import List, Dict
+from typing import List, Dict, NamedTuple
 import os
 import random
+import threading
 from enum import IntEnum
 import sqlite3
-from bs4 import BeautifulSoup, Tag
+from pathlib import Path
+from lxml import etree
 
+import numpy as np
 import qrcode
 
 
 DB_PATH = os.path.join("data", "jisho_words.db")
 
+# Font faces are resolved once and shared by every render
+FONT_FACE_BOLD = cairo.ToyFontFace("Noto Sans JP", cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
+FONT_FACE_NORMAL = cairo.ToyFontFace("Noto Sans JP", cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
+
 def get_pat_path(idx):
     pattern_base_path = os.path.join("www", "img")
     return os.path.join(pattern_base_path, f"gray-{idx}.png")
 
-def get_all_words() -> List[Dict]:
-    # Connect to database
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+# Every word query reads meaning wrappers joined to their word
+WORDS_FROM = """
+FROM meaning_wrappers mw
+JOIN words w ON mw.word_id = w.id
+"""
 
-    try:
-        query = """
-        SELECT
-            mw.wrapper_html as meaning_wrapper,
-            w.representation_html as representation,
-            mw.word_id,
-            mw.id as meaning_wrapper_id
-        FROM meaning_wrappers mw
-        JOIN words w ON mw.word_id = w.id
-        ORDER BY mw.word_id, mw.id
-        """
-
-        cursor = conn.cursor()
-        cursor.execute(query, )
-        rows = cursor.fetchall()
-
-        return [dict(row) for row in rows]
-
-    finally:
-        conn.close()
+def connect_db() -> sqlite3.Connection:
+    # The word database is only read here, open it read-only and let
+    # SQLite serve pages from a memory map and a larger page cache
+    conn = sqlite3.connect(Path(DB_PATH).resolve().as_uri() + "?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA query_only=1")
+    return conn
+
+_local = threading.local()
+
+def get_connection() -> sqlite3.Connection:
+    # One connection per thread, reopened in forked worker processes
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.conn = connect_db()
+        _local.pid = os.getpid()
+    return _local.conn
+
+@functools.lru_cache(maxsize=1)
+def get_word_keys() -> List[tuple[int, int]]:
+    # (word_id, meaning_wrapper_id) of every meaning wrapper, in word order
+    query = f"SELECT mw.word_id, mw.id {WORDS_FROM} ORDER BY mw.word_id, mw.id"
+    return [(word_id, meaning_wrapper_id) for word_id, meaning_wrapper_id in get_connection().execute(query)]
+
+def count_all_words() -> int:
+    return len(get_word_keys())
+
+def get_word(index: int) -> sqlite3.Row:
+    word_id, meaning_wrapper_id = get_word_keys()[index]
+    query = f"""
+    SELECT
+        mw.wrapper_html as meaning_wrapper,
+        w.representation_html as representation,
+        mw.word_id,
+        mw.id as meaning_wrapper_id
+    {WORDS_FROM}
+    WHERE mw.word_id = ? AND mw.id = ?
+    """
+    return get_connection().execute(query, (word_id, meaning_wrapper_id)).fetchone()
+
+_parser_local = threading.local()
+
+def get_html_parser() -> etree.HTMLParser:
+    # One parser per thread, reused for every fragment. A custom lxml parser
+    # has a single context behind a lock, sharing it would serialize renders
+    parser = getattr(_parser_local, "parser", None)
+    if parser is None:
+        parser = _parser_local.parser = etree.HTMLParser(recover=True, encoding="utf-8")
+    return parser
+
+def class_xpath(path: str, class_name: str) -> etree.XPath:
+    # Match class_name as one of the element's classes, like bs4's class_ filter
+    return etree.XPath(f'{path}[contains(concat(" ", normalize-space(@class), " "), " {class_name} ")]')
+
+MEANING_SPAN_XPATH = class_xpath("//span", "meaning-meaning")
+ENGLISH_SPAN_XPATH = class_xpath("//span", "english")
+SENTENCE_UL_XPATH = etree.XPath("//ul")
+FURIGANA_SPAN_XPATH = class_xpath(".//span", "furigana")
+UNLINKED_SPAN_XPATH = class_xpath(".//span", "unlinked")
+REPRESENTATION_DIV_XPATH = class_xpath("//div", "concept_light-representation")
+TEXT_SPAN_XPATH = class_xpath(".//span", "text")
+
+def first_match(xpath: etree.XPath, element):
+    matches = xpath(element)
+    return matches[0] if matches else None
+
+def get_text_strip(element) -> str:
+    # Same as bs4's get_text(strip=True), every text node stripped and joined
+    return "".join(text.strip() for text in element.itertext())
+
+def get_text(element) -> str:
+    return "".join(element.itertext())
 
 def extract_meaning(html: str) -> tuple[str, List[tuple], str]:
-    soup = BeautifulSoup(html, "html.parser")
+    tree = etree.fromstring(html.encode(), get_html_parser())
+    # Nothing parsed from an empty, blank or comment-only fragment
+    if tree is None:
+        return "", [], ""
+
     # Extract meaning-meaning
-    meaning_span = soup.find("span", class_="meaning-meaning")
-    meaning = meaning_span.get_text(strip=True) if meaning_span else ""
+    meaning_span = first_match(MEANING_SPAN_XPATH, tree)
+    meaning = get_text_strip(meaning_span) if meaning_span is not None else ""
 
     # Extract all <li> elements inside the first <ul>
     li_elements = []
-    ul = soup.find("ul")
-    if ul and isinstance(ul, Tag):
-        for li in ul.find_all("li"):
-            if not isinstance(li, Tag):
-                continue
+    ul = first_match(SENTENCE_UL_XPATH, tree)
+    if ul is not None:
+        for li in ul.iter("li"):
             # Extract furigana and unlinked text if present
             furigana = None
             unlinked = None
-            furigana_span = li.find("span", class_="furigana")
-            if furigana_span:
-                furigana = furigana_span.get_text(strip=True)
-            unlinked_span = li.find("span", class_="unlinked")
-            if unlinked_span:
-                unlinked = unlinked_span.get_text(strip=True)
+            furigana_span = first_match(FURIGANA_SPAN_XPATH, li)
+            if furigana_span is not None:
+                furigana = get_text_strip(furigana_span)
+            unlinked_span = first_match(UNLINKED_SPAN_XPATH, li)
+            if unlinked_span is not None:
+                unlinked = get_text_strip(unlinked_span)
             li_elements.append((furigana, unlinked))
 
     # Extract english sentence
-    english_span = soup.find("span", class_="english")
-    english = english_span.get_text(strip=True) if english_span else ""
+    english_span = first_match(ENGLISH_SPAN_XPATH, tree)
+    english = get_text_strip(english_span) if english_span is not None else ""
 
     return meaning, li_elements, english
 
-class RepresentationBlock:
-    def __init__(self, kanji: str, furigana: str, furigana_span: str|None = None):
-        self.kanji = kanji
-        self.furigana = furigana
-        self.furigana_span = furigana_span
-
-    def __repr__(self):
-        return f"RepresentationBlock(kanji={self.kanji!r}, furigana={self.furigana!r}, furigana_span={self.furigana_span!r})"
-
-class TextBlock:
-    def __init__(self, char: str, is_span: bool):
-        if char is None:
-            self.char = ""
-        else:
-            self.char = char
-        self.is_span = is_span
-
-    def __len__(self):
-        if self.is_span:
-            return 1
-        else:
-            return len(self.char)
-
-    def __repr__(self):
-        return self.char
+class Word(NamedTuple):
+    # Parallel lists, one entry per kanji block of the word
+    kanji: List[str]
+    furigana: List[str]
+    furigana_span: List[str|None]
 
 class FullMeaning:
-    def __init__(self, word: List[RepresentationBlock], meaning: str, japanese: List[tuple], english: str):
+    def __init__(self, word: Word, meaning: str, japanese: List[tuple], english: str):
         self.word = word
         self.meaning = meaning
         self.japanese = japanese
@@ -111,85 +158,127 @@ class FullMeaning:
         return f"FullMeaning(word={self.word!r}, meaning={self.meaning!r}, japanese={self.japanese!r}, english={self.english!r})"
 
 def extract_representation(html: str):
-    soup = BeautifulSoup(html, 'html.parser')
-    concept_div = soup.find('div', class_='concept_light-representation')
+    tree = etree.fromstring(html.encode(), get_html_parser())
+    if tree is None:
+        return Word([], [], [])
+    concept_div = first_match(REPRESENTATION_DIV_XPATH, tree)
 
-    if not concept_div:
-        return []
+    if concept_div is None:
+        return Word([], [], [])
 
     furigana = []
     furigana_span = []
     text = []
+    text_is_span = []
 
     # Extract furigana elements with precise structure analysis
-    assert isinstance(concept_div, Tag)
-    furigana_span_div = concept_div.find('span', class_='furigana')
-    if furigana_span_div and isinstance(furigana_span_div, Tag):
-        for child in furigana_span_div.children:
-            if getattr(child, 'name', None) == 'span':
-                furigana.append(child.text.strip())
+    furigana_span_div = first_match(FURIGANA_SPAN_XPATH, concept_div)
+    if furigana_span_div is not None:
+        # Text between the children would have been a bare string child
+        if furigana_span_div.text:
+            raise ValueError(f"Unexpected element in furigana span: {furigana_span_div.text!r}")
+        for child in furigana_span_div:
+            if child.tag == 'span':
+                furigana.append(get_text(child).strip())
                 furigana_span.append(None)
-            elif getattr(child, 'name', None) == 'ruby':
-                assert isinstance(child, Tag)
-                rt = child.find('rt')
-                rb = child.find('rb')
+            elif child.tag == 'ruby':
+                rt = child.find('.//rt')
+                rb = child.find('.//rb')
                 if rt is None:
                     raise ValueError("Malformed ruby element: missing <rt>")
-                furigana.append(rt.text.strip())
-                furigana_span.append(rb.text.strip() if rb else None)
+                furigana.append(get_text(rt).strip())
+                furigana_span.append(get_text(rb).strip() if rb is not None else None)
             else:
-                raise ValueError(f"Unexpected element in furigana span: {child}")
+                raise ValueError(f"Unexpected element in furigana span: {etree.tostring(child, encoding='unicode')}")
+            if child.tail:
+                raise ValueError(f"Unexpected element in furigana span: {child.tail!r}")
 
     # Extract text elements with precise structure analysis
-    text_span = concept_div.find('span', class_='text')
-    assert isinstance(text_span, Tag)
-    if text_span:
-        for content in text_span.contents:
-            if isinstance(content, str) and content.strip():
-                text.append(TextBlock(content.strip(), is_span=False))
-            elif getattr(content, 'name', None) == 'span':
-                text.append(TextBlock(content.text.strip(), is_span=True))
+    text_span = first_match(TEXT_SPAN_XPATH, concept_div)
+    assert text_span is not None
+    # Bare text sits in the span's .text and in each child's .tail
+    stripped = (text_span.text or "").strip()
+    if stripped:
+        text.append(stripped)
+        text_is_span.append(False)
+    for child in text_span:
+        if child.tag == 'span':
+            text.append(get_text(child).strip())
+            text_is_span.append(True)
+        stripped = (child.tail or "").strip()
+        if stripped:
+            text.append(stripped)
+            text_is_span.append(False)
 
     if len(furigana) == len(text):
-        return [RepresentationBlock(kanji=str(k), furigana=f, furigana_span=fs) for k, f, fs in zip(text, furigana, furigana_span)]
-    elif len(furigana) == sum(len(tb) for tb in text):
+        return Word(text, furigana, furigana_span)
+    # A span is one block, bare text is one block per character
+    elif len(furigana) == sum(1 if is_span else len(t) for t, is_span in zip(text, text_is_span)):
         combined_text = []
-        for tb in text:
-            if tb.is_span:
-                combined_text.append(str(tb))
+        for t, is_span in zip(text, text_is_span):
+            if is_span:
+                combined_text.append(t)
             else:
-                combined_text.extend(list(tb.char))
-        return [RepresentationBlock(kanji=k, furigana=f, furigana_span=fs) for k, f, fs in zip(combined_text, furigana, furigana_span)]
+                combined_text.extend(t)
+        return Word(combined_text, furigana, furigana_span)
 
     raise ValueError("Mismatch between furigana and text lengths")
 
+# Text is measured once at a reference size on a scratch context and scaled linearly,
+# a large reference keeps glyph bounding boxes from being quantized at tiny sizes
+MEASURE_FONT_SIZE = 100.0
+
+_measure_font_options = cairo.FontOptions()
+_measure_font_options.set_hint_style(cairo.HINT_STYLE_NONE)
+_measure_font_options.set_hint_metrics(cairo.HINT_METRICS_OFF)
+_measure_ctx = cairo.Context(cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, None))
+_measure_ctx.set_font_options(_measure_font_options)
+# Renders run in worker threads and a cairo context must not be shared between them
+_measure_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=4096)
+def _measure(family: str, slant: int, weight: int, text: str) -> tuple[float, float]:
+    with _measure_lock:
+        _measure_ctx.select_font_face(family, slant, weight)
+        _measure_ctx.set_font_size(MEASURE_FONT_SIZE)
+        extents = _measure_ctx.text_extents(text)
+    return extents.x_advance / MEASURE_FONT_SIZE, extents.height / MEASURE_FONT_SIZE
+
+def measure_text(ctx: cairo.Context, text: str) -> tuple[float, float]:
+    """Return (x_advance, height) of text at font size 1 in the font face currently selected on ctx."""
+    font_face = ctx.get_font_face()
+    return _measure(font_face.get_family(), font_face.get_slant(), font_face.get_weight(), text)
+
+def _max_font_size(extent: float, max_extent: float) -> float:
+    # Largest integer size with size * extent < max_extent
+    if extent <= 0:
+        return math.inf
+    return math.ceil(max_extent / extent) - 1
+
+def _fit_font_size(extent: float, max_extent: float, initial_size: int, min_size: int) -> int:
+    # Largest size in [min_size, initial_size] that fits, min_size - 1 if even min_size does not fit
+    return max(min(initial_size, _max_font_size(extent, max_extent)), min_size - 1)
+
+def _fit_font_sizes(extent: float, max_extent: float, initial_sizes: np.ndarray, min_size: int) -> np.ndarray:
+    # _fit_font_size over an array of initial sizes
+    return np.maximum(np.minimum(initial_sizes, _max_font_size(extent, max_extent)), min_size - 1)
+
+def fits_width(ctx: cairo.Context, text: str, max_width: float, font_size: float) -> bool:
+    x_advance, _ = measure_text(ctx, text)
+    return x_advance * font_size < max_width
+
 def get_font_size_constraint_width(ctx: cairo.Context, text: str, max_width: float, initial_size: int = 96, min_size: int = 8) -> int:
-    font_size = initial_size
-    while True:
-        ctx.set_font_size(font_size)
-        extents = ctx.text_extents(text)
-        if extents.x_advance < max_width:
-            return font_size
-        else:
-            font_size -= 1
-            if font_size < min_size:
-                return font_size
+    x_advance, _ = measure_text(ctx, text)
+    return _fit_font_size(x_advance, max_width, initial_size, min_size)
 
 def get_font_size_constraint_height(ctx: cairo.Context, text: str, furigana: str, max_height: float, initial_size: int = 96, min_size: int = 8) -> int:
-    font_size = initial_size
-    while True:
-        ctx.set_font_size(font_size)
-        extents = ctx.text_extents(text)
-        ctx.set_font_size(font_size/3)
-        extents_furigana = ctx.text_extents(furigana)
-        if (extents.height + extents_furigana.height) < max_height:
-            return font_size
-        else:
-            font_size -= 1
-            if font_size < min_size:
-                return font_size
+    # Furigana is drawn at a third of the text size
+    _, height = measure_text(ctx, text)
+    _, height_furigana = measure_text(ctx, furigana)
+    return _fit_font_size(height + height_furigana / 3, max_height, initial_size, min_size)
 
-def plot_qr_code(ctx: cairo.Context, data: str, qr_code_width: int, plot_width: int):
+@functools.lru_cache(maxsize=4096)
+def get_qr_matrix(data: str) -> np.ndarray:
     qr = qrcode.QRCode(
         error_correction=qrcode.ERROR_CORRECT_H,
         border=0,
@@ -198,8 +287,14 @@ def plot_qr_code(ctx: cairo.Context, data: str, qr_code_width: int, plot_width:
     qr.add_data(data)
     qr.make(fit=True)
 
+    # Shared between callers through the cache, keep it read-only
+    matrix = np.array(qr.get_matrix(), dtype=bool)
+    matrix.flags.writeable = False
+    return matrix
+
+def plot_qr_code(ctx: cairo.Context, data: str, qr_code_width: int, plot_width: int):
     # Get QR code matrix
-    matrix = qr.get_matrix()
+    matrix = get_qr_matrix(data)
     size = len(matrix)
     # box_size = qr.box_size
     # border = qr.border
@@ -211,48 +306,41 @@ def plot_qr_code(ctx: cairo.Context, data: str, qr_code_width: int, plot_width:
     dot_size = qr_code_width / size
 
     # Draw QR code modules
-    for y in range(size):
-        for x in range(size):
-            if matrix[y][x]:
-                ctx.rectangle(
-                    x * dot_size + offset_x,
-                    y * dot_size,
-                    dot_size, dot_size
-                )
-                ctx.fill()
+    fill_module_runs(ctx, matrix, offset_x, dot_size)
 
     # Draw "white dots" of QR code
     ctx.set_source_rgb(255, 255, 255)
 
-    for y in range(size):
-        for x in range(size):
-            if not matrix[y][x]:
-                ctx.rectangle(
-                    x * dot_size + offset_x,
-                    y * dot_size,
-                    dot_size, dot_size
-                )
-                ctx.fill()
+    fill_module_runs(ctx, ~matrix, offset_x, dot_size)
 
     ctx.set_source_rgb(0, 0, 0)
 
+def fill_module_runs(ctx: cairo.Context, modules: np.ndarray, offset_x: float, dot_size: float):
+    # One rectangle per horizontal run of set modules, filled with a single path
+    padded = np.zeros((modules.shape[0], modules.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = modules
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+
+    for y, start, end in zip(rows.tolist(), starts.tolist(), ends.tolist()):
+        ctx.rectangle(
+            start * dot_size + offset_x,
+            y * dot_size,
+            (end - start) * dot_size, dot_size
+        )
+    ctx.fill()
+
 def get_center_semicolon_pos(string: str) -> int:
-    idx = 0
-    length = len(string)
-    if string[length // 2] == ';':
-        return length // 2
-
-    while True:
-        idx += 1
-        left_idx = (length // 2) - idx
-        right_idx = (length // 2) + idx
-        if left_idx >= 0 and string[left_idx] == ';':
-            return left_idx
-        if right_idx < length and string[right_idx] == ';':
-            return right_idx
-        if left_idx < 0 and right_idx >= length:
-            break
-    return -1
+    # Nearest ';' on either side of the middle, the left one wins a tie
+    mid = len(string) // 2
+    left_idx = string.rfind(';', 0, mid + 1)
+    right_idx = string.find(';', mid)
+    if left_idx < 0:
+        return right_idx
+    if right_idx < 0:
+        return left_idx
+    return left_idx if (mid - left_idx) <= (right_idx - mid) else right_idx
 
 def plot_japanese(data: FullMeaning, name: str, width: int = 780, height: int = 460) -> str:
     config_margin_top = 10
@@ -278,159 +366,163 @@ def plot_japanese(data: FullMeaning, name: str, width: int = 780, height: int =
     plot_width = container_width - config_margin_left - config_margin_right
     plot_height = container_height - config_margin_top - config_margin_bottom
 
-    svg_path = os.path.join("www", "img", f"{name}.svg")
-
-    svg_surface = cairo.SVGSurface(svg_path, container_width, container_height)
-
-    ctx = cairo.Context(svg_surface)
+    # The size is part of the file name so renders of one word at different sizes
+    # don't overwrite each other, and each render writes to its own temporary
+    # file that is moved into place once complete, so a concurrent reader never
+    # sees a half-written SVG
+    svg_path = os.path.join("www", "img", f"{name}-{width}x{height}.svg")
+    tmp_path = f"{svg_path}.{os.getpid()}-{threading.get_ident()}.tmp"
 
-    ctx.save()
-    ctx.translate(config_margin_left, config_margin_top)
+    svg_surface = cairo.SVGSurface(tmp_path, container_width, container_height)
 
-    ctx.select_font_face("Noto Sans JP",
-                         cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
-
-    ctx.set_source_rgb(0, 0, 0)
+    try:
+        ctx = cairo.Context(svg_surface)
 
-    kanji = "".join([str(block.kanji) for block in data.word])
-    jisho_url = f"https://jisho.org/search/{kanji}"
+        ctx.save()
+        ctx.translate(config_margin_left, config_margin_top)
 
-    font_size_w = get_font_size_constraint_width(ctx, kanji, plot_width, initial_size=150, min_size=48)
-    font_size_h = get_font_size_constraint_height(ctx, kanji, "フリガナ", plot_height/2, initial_size=150, min_size=48)
-    font_size = min(font_size_w, font_size_h)
+        ctx.set_font_face(FONT_FACE_BOLD)
 
-    ctx.set_font_size(font_size)
-    extents = ctx.text_extents(kanji)
-    x_pos = (plot_width - extents.x_advance) / 2
-    y_pos = (plot_height / 2) - config_margin_bottom
-    y_pos_furigana = y_pos - extents.height
+        ctx.set_source_rgb(0, 0, 0)
 
-    for block in data.word:
-        # Draw text
-        ctx.move_to(x_pos, y_pos)
-        kanji = str(block.kanji)
-        kanji_extents = ctx.text_extents(kanji)
-        ctx.show_text(kanji)
+        kanji = "".join(data.word.kanji)
+        jisho_url = f"https://jisho.org/search/{kanji}"
 
+        font_size_w = get_font_size_constraint_width(ctx, kanji, plot_width, initial_size=150, min_size=48)
+        font_size_h = get_font_size_constraint_height(ctx, kanji, "フリガナ", plot_height/2, initial_size=150, min_size=48)
+        font_size = min(font_size_w, font_size_h)
 
-        ctx.set_font_size(font_size/3)
-        furigana = block.furigana
-        furigana_extents = ctx.text_extents(furigana)
-        x_pos_furigana = x_pos + (kanji_extents.x_advance - furigana_extents.x_advance) / 2
-        ctx.move_to(x_pos_furigana, y_pos_furigana)
-
-        ctx.show_text(furigana)
         ctx.set_font_size(font_size)
-        x_pos += kanji_extents.x_advance + 3
+        extents = ctx.text_extents(kanji)
+        x_pos = (plot_width - extents.x_advance) / 2
+        y_pos = (plot_height / 2) - config_margin_bottom
+        y_pos_furigana = y_pos - extents.height
+
+        # Draw every kanji block first, then every furigana, so the font size changes only once
+        kanji_positions = []
+        for kanji in data.word.kanji:
+            # Draw text
+            ctx.move_to(x_pos, y_pos)
+            kanji_extents = ctx.text_extents(kanji)
+            ctx.show_text(kanji)
+            kanji_positions.append((x_pos, kanji_extents.x_advance))
+            x_pos += kanji_extents.x_advance + 3
 
+        ctx.set_font_size(font_size/3)
+        for furigana, (x_pos, kanji_x_advance) in zip(data.word.furigana, kanji_positions):
+            furigana_extents = ctx.text_extents(furigana)
+            x_pos_furigana = x_pos + (kanji_x_advance - furigana_extents.x_advance) / 2
+            ctx.move_to(x_pos_furigana, y_pos_furigana)
+            ctx.show_text(furigana)
 
-    ctx.select_font_face("Noto Sans JP",
-                        cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
-    meaning = data.meaning
 
-    semicolon_pos = get_center_semicolon_pos(meaning)
-    meaning_padding_top = 20
-    font_size = get_font_size_constraint_width(ctx, meaning, plot_width, initial_size=meaning_font_size, min_size=8)
-    ctx.set_font_size(meaning_font_size)
+        ctx.set_font_face(FONT_FACE_NORMAL)
+        meaning = data.meaning
+
+        meaning_padding_top = 20
+        ctx.set_font_size(meaning_font_size)
+
+        # Only look for a line break when the meaning does not fit on one line
+        semicolon_pos = -1
+        if not fits_width(ctx, meaning, plot_width, meaning_font_size):
+            semicolon_pos = get_center_semicolon_pos(meaning)
+
+        if semicolon_pos != -1:
+            # break into two lines
+            meaning_left  = meaning[:semicolon_pos] + ";"
+            meaning_right = meaning[semicolon_pos+2:]
+            extents = ctx.text_extents(meaning_left)
+            x_pos = (plot_width - extents.x_advance) / 2
+            y_pos = y_pos + extents.height + meaning_padding_top
+            meaning_left_height = extents.height
+            ctx.move_to(x_pos, y_pos)
+            ctx.show_text(meaning_left)
+            extents = ctx.text_extents(meaning_right)
+            x_pos = (plot_width - extents.x_advance) / 2
+            y_pos = y_pos + meaning_left_height
+            ctx.move_to(x_pos, y_pos)
+            ctx.show_text(meaning_right)
+        else:
+            extents = ctx.text_extents(meaning)
+            x_pos = (plot_width - extents.x_advance) / 2
+            y_pos = y_pos + extents.height + meaning_padding_top
+            ctx.move_to(x_pos, y_pos)
+            ctx.show_text(meaning)
+
+        y_pos_en_meaning = y_pos + extents.height
+
+        japanese_sentence = ""
+        for furigana, kanji in data.japanese:
+            japanese_sentence += kanji if kanji is not None else ""
+        font_size_jp = get_font_size_constraint_width(ctx, japanese_sentence, plot_width, initial_size=28, min_size=8)
+        font_size_en = get_font_size_constraint_width(ctx, data.english, plot_width, initial_size=20, min_size=8)
+
+        # Lay out every size reduction step at once, step 0 is the fit above and each
+        # further step shrinks both sentences by one more point, up to 9 steps
+        x_advance_jp, _ = measure_text(ctx, japanese_sentence)
+        x_advance_en, _ = measure_text(ctx, data.english)
+        _, height_kanji = measure_text(ctx, "漢字")
+        _, height_english = measure_text(ctx, "English")
+
+        size_reduction_steps = np.arange(10)
+        font_sizes_jp = _fit_font_sizes(x_advance_jp, plot_width, font_size_jp - size_reduction_steps, 8)
+        font_sizes_en = _fit_font_sizes(x_advance_en, plot_width, font_size_en - size_reduction_steps, 8)
+
+        y_pos_en = np.where(size_reduction_steps == 0, plot_height - 10, plot_height - 3)
+        y_pos_kanji = y_pos_en - font_sizes_en * height_english - 5
+        y_pos_furigana = y_pos_kanji - font_sizes_jp * height_kanji
+
+        # Check if meaning overlaps with japanese sentence, if so, take the first reduced size that clears it
+        fitting_steps = np.flatnonzero(y_pos_en_meaning <= y_pos_furigana)
+        size_reduction_step = fitting_steps[0] if len(fitting_steps) else size_reduction_steps[-1]
+        font_size_jp = int(font_sizes_jp[size_reduction_step])
+        font_size_en = int(font_sizes_en[size_reduction_step])
+        y_pos_en = float(y_pos_en[size_reduction_step])
+        y_pos_kanji = float(y_pos_kanji[size_reduction_step])
+        y_pos_furigana = float(y_pos_furigana[size_reduction_step])
 
-    if font_size != meaning_font_size and semicolon_pos != -1:
-        # break into two lines
-        meaning_left  = meaning[:semicolon_pos] + ";"
-        meaning_right = meaning[semicolon_pos+2:]
-        extents = ctx.text_extents(meaning_left)
-        x_pos = (plot_width - extents.x_advance) / 2
-        y_pos = y_pos + extents.height + meaning_padding_top
-        meaning_left_height = extents.height
-        ctx.move_to(x_pos, y_pos)
-        ctx.show_text(meaning_left)
-        extents = ctx.text_extents(meaning_right)
-        x_pos = (plot_width - extents.x_advance) / 2
-        y_pos = y_pos + meaning_left_height
-        ctx.move_to(x_pos, y_pos)
-        ctx.show_text(meaning_right)
-    else:
-        extents = ctx.text_extents(meaning)
-        x_pos = (plot_width - extents.x_advance) / 2
-        y_pos = y_pos + extents.height + meaning_padding_top
-        ctx.move_to(x_pos, y_pos)
-        ctx.show_text(meaning)
-
-    y_pos_en_meaning = y_pos + extents.height
-
-    japanese_sentence = ""
-    for furigana, kanji in data.japanese:
-        japanese_sentence += kanji if kanji is not None else ""
-    font_size_jp = get_font_size_constraint_width(ctx, japanese_sentence, plot_width, initial_size=28, min_size=8)
-    font_size_en = get_font_size_constraint_width(ctx, data.english, plot_width, initial_size=20, min_size=8)
-
-    ctx.set_font_size(font_size_jp)
-    height_kanji = ctx.text_extents("漢字").height
-    ctx.set_font_size(font_size_jp/3)
-    height_furigana = ctx.text_extents("ふりがな").height
-    ctx.set_font_size(font_size_en)
-    height_english = ctx.text_extents("English").height
-
-    y_pos_en = plot_height - 10
-    y_pos_kanji = y_pos_en - height_english - 5
-    y_pos_furigana = y_pos_kanji - height_kanji
-
-    # Check if meaning overlaps with japanese sentence, if so, reduce font size
-    size_reduction_step = 1
-    initial_size_jp = font_size_jp
-    initial_size_en = font_size_en
-    while (y_pos_en_meaning > y_pos_furigana):
-        font_size_jp = get_font_size_constraint_width(ctx, japanese_sentence, plot_width, initial_size=initial_size_jp-size_reduction_step, min_size=8)
-        font_size_en = get_font_size_constraint_width(ctx, data.english, plot_width, initial_size=initial_size_en-size_reduction_step, min_size=8)
         ctx.set_font_size(font_size_jp)
-        height_kanji = ctx.text_extents("漢字").height
-        ctx.set_font_size(font_size_jp/3)
-        height_furigana = ctx.text_extents("ふりがな").height
-        ctx.set_font_size(font_size_en)
-        height_english = ctx.text_extents("English").height
-
-        y_pos_en = plot_height - 3
-        y_pos_kanji = y_pos_en - height_english - 5
-        y_pos_furigana = y_pos_kanji - height_kanji
-        size_reduction_step += 1
-        if size_reduction_step == 10:
-            break
-
-    ctx.set_font_size(font_size_jp)
-    extents = ctx.text_extents(japanese_sentence)
-    x_pos = (plot_width - extents.x_advance) / 2
+        extents = ctx.text_extents(japanese_sentence)
+        x_pos = (plot_width - extents.x_advance) / 2
 
-    for furigana, kanji in data.japanese:
-        if kanji is None:
-            raise ValueError("Kanji cannot be None in japanese sentence")
+        # Same here, all kanji at font_size_jp, then all furigana at half of it
+        kanji_x_positions = []
+        for furigana, kanji in data.japanese:
+            if kanji is None:
+                raise ValueError("Kanji cannot be None in japanese sentence")
 
-        ctx.set_font_size(font_size_jp)
-        kanji_extents = ctx.text_extents(kanji)
-        ctx.move_to(x_pos, y_pos_kanji)
-        ctx.show_text(kanji)
-
-        if furigana is not None:
-            ctx.set_font_size(font_size_jp/2)
-            extents = ctx.text_extents(furigana)
-            ctx.move_to(x_pos, y_pos_furigana)
-            ctx.show_text(furigana)
+            kanji_x_positions.append(x_pos)
+            ctx.move_to(x_pos, y_pos_kanji)
+            ctx.show_text(kanji)
+            x_pos += ctx.text_extents(kanji).x_advance
 
-        x_pos += kanji_extents.x_advance
+        ctx.set_font_size(font_size_jp/2)
+        for (furigana, _), x_pos in zip(data.japanese, kanji_x_positions):
+            if furigana is not None:
+                ctx.move_to(x_pos, y_pos_furigana)
+                ctx.show_text(furigana)
 
-    ctx.set_font_size(font_size_en)
-    extents = ctx.text_extents(data.english)
-    x_pos = (plot_width - extents.x_advance) / 2
-    ctx.move_to(x_pos, y_pos_en)
-    ctx.show_text(data.english)
+        ctx.set_font_size(font_size_en)
+        extents = ctx.text_extents(data.english)
+        x_pos = (plot_width - extents.x_advance) / 2
+        ctx.move_to(x_pos, y_pos_en)
+        ctx.show_text(data.english)
 
-    if show_dr_code:
-        plot_qr_code(ctx, jisho_url, 98, plot_width=plot_width)
+        if show_dr_code:
+            plot_qr_code(ctx, jisho_url, 98, plot_width=plot_width)
 
-    ctx.restore()
-    svg_surface.finish()
+        ctx.restore()
+        svg_surface.finish()
+    except BaseException:
+        # Don't leave the temporary file behind, its name is new on every run
+        svg_surface.finish()
+        os.unlink(tmp_path)
+        raise
+    os.replace(tmp_path, svg_path)
 
     return svg_path
 
-def plot_word(word, width: int = 780, height: int = 460, name=None) -> str:
+def plot_word(word: sqlite3.Row, width: int = 780, height: int = 460, name=None) -> str:
     try:
         word_id = word["word_id"]
         meaning_wrapper_id = word["meaning_wrapper_id"]
@@ -446,30 +538,32 @@ def plot_word(word, width: int = 780, height: int = 460, name=None) -> str:
         return ""
 
 def generate_word(width: int = 780, height: int = 460, word_id: int = 0) -> str:
-    data = get_all_words()
-    d = data[word_id]
-    return plot_word(d, width, height)
+    return plot_word(get_word(word_id), width, height)
 
-def generate_word_date(width: int = 780, height: int = 460, date_str: str = "", offset: int = 0) -> str:
-    data = get_all_words()
+def get_word_index_date(date_str: str = "", offset: int = 0) -> int:
     seed = int(hashlib.md5(date_str.encode()).hexdigest(), 16) % (2**32)
-    random.seed(seed)
-    data_rand = random.sample(data, 4)
-    return plot_word(data_rand[offset % 4], width, height)
+    # Sampling row positions picks the same words as sampling the full list did,
+    # a private Random keeps concurrent renders from reseeding each other
+    indices = random.Random(seed).sample(range(count_all_words()), 4)
+    return indices[offset % 4]
 
-if __name__ == '__main__':
-    # data = get_all_words()
-    # for d in data:
-    #     plot_word(d, 780, 460)
-    #     # plot_word(d, int(780/2), int(460/2))
+def generate_word_date(width: int = 780, height: int = 460, date_str: str = "", offset: int = 0) -> str:
+    return generate_word(width, height, get_word_index_date(date_str, offset))
 
+if __name__ == '__main__':
     start_date = datetime(2026, 1, 1)
     end_date = datetime(2026, 12, 31)
 
+    # Several dates can land on the same word, render each word once so
+    # no two workers write the same SVG file
+    word_indices = set()
     current_date = start_date
     while current_date <= end_date:
-        generate_word_date(780, 420, current_date.strftime('%Y%m%d'), 0)
+        word_indices.add(get_word_index_date(current_date.strftime('%Y%m%d'), 0))
         current_date += timedelta(days=1)
 
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(executor.map(functools.partial(generate_word, 780, 420), sorted(word_indices), chunksize=32))
+
 #FIXME: Edge case example
 # <div class="meaning-wrapper"><div class="meaning-definition zero-padding"><span class="meaning-meaning">counter for gunshots, bursts of gas, etc.; counter for bullets, bombs, etc.; counter for blows (punches); counter for jokes, puns, etc.; counter for ideas, thoughts or guesses</span></div><span class="sentences zero-padding"><div class="sentence" style=""><ul class="japanese japanese_gothic clearfix" lang="ja"><li class="clearfix"><span class="furigana">かれ</span><span class="unlinked">彼</span></li><li class="clearfix"><span class="unlinked">は</span></li>３<li class="clearfix"><span class="furigana">はつ</span><span class="unlinked"><span class="hit">発</span></span></li><li class="clearfix"><span class="furigana">う</span><span class="unlinked">撃った</span></li>。</ul><span class="english" lang="en">He fired three shots.</span></div></span></div>
\ No newline at end of file
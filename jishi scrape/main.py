@@ -4,8 +4,9 @@ import time
 from tqdm import tqdm
 import sys
 import json
-from bs4 import BeautifulSoup
-from bs4.element import Tag as bs_Tag_t
+import re
+from lxml import etree
+from lxml import html as lh
 
 import sqlite3
 from pathlib import Path
@@ -82,12 +83,57 @@ def create_combined_html(extracted_results, output_file="combined_results.html")
     print(f"Successfully created combined HTML file: {output_file}")
     print(f"Total words included: {total_words}")
 
-def extract_words_with_sentences(soup):
+def class_xpath(path, class_name):
+    # Match class_name as one of the element's classes, like bs4's class_ filter
+    return etree.XPath(f'{path}[contains(concat(" ", normalize-space(@class), " "), " {class_name} ")]')
+
+WORD_ENTRY_XPATH = class_xpath("//div", "concept_light")
+REPRESENTATION_XPATH = class_xpath(".//div", "concept_light-representation")
+MEANING_WRAPPER_XPATH = class_xpath(".//div", "meaning-wrapper")
+SENTENCE_XPATH = class_xpath(".//div", "sentence")
+DIVIDER_XPATH = class_xpath(".//span", "meaning-definition-section_divider")
+SUPPLEMENTAL_INFO_XPATH = class_xpath(".//span", "supplemental_info")
+# Void elements bs4 writes self-closed, lxml's HTML serializer never escapes
+# a raw '>' inside a tag so the first one closes it
+VOID_TAG_RE = re.compile(r'(<(?:area|base|br|col|embed|hr|img|input|link|meta|param|source|track|wbr)\b[^>]*)>')
+
+def bs4_string(element):
+    # Same as bs4's .string, the element's text when it is its only child,
+    # following a chain of elements that each have a single child
+    while True:
+        children = list(element)
+        if element.text:
+            return element.text if not children else None
+        if len(children) != 1 or children[0].tail:
+            return None
+        element = children[0]
+
+def collapse_whitespace(element):
+    # Whitespace-only text is collapsed to ' ', or dropped when it spans lines,
+    # as bs4 did while parsing. Must run before any span is dropped, lxml then
+    # merges the surrounding text into one node
+    for node in element.iter():
+        if isinstance(node.tag, str) and node.text and not node.text.strip(' \t\n\r\f'):
+            node.text = '' if '\n' in node.text else ' '
+        if node is not element and node.tail and not node.tail.strip(' \t\n\r\f'):
+            node.tail = '' if '\n' in node.tail else ' '
+
+def to_html(element):
+    # Attributes sorted and void elements self-closed, the same output bs4 gave
+    for node in element.iter():
+        if isinstance(node.tag, str) and len(node.attrib):
+            attributes = sorted(node.attrib.items())
+            node.attrib.clear()
+            node.attrib.update(attributes)
+    html = etree.tostring(element, encoding='unicode', method='html', with_tail=False)
+    return VOID_TAG_RE.sub(r'\1/>', html)
+
+def extract_words_with_sentences(tree):
     """
-    Extract words with sentences from jisho.org HTML soup.
+    Extract words with sentences from a parsed jisho.org page.
 
     Args:
-        soup: BeautifulSoup object of jisho.org word search page
+        tree: lxml.html document of jisho.org word search page
 
     Returns:
         List of dictionaries containing:
@@ -98,48 +144,44 @@ def extract_words_with_sentences(soup):
     results = []
 
     # Find all word entries
-    word_entries = soup.find_all('div', class_='concept_light')
+    word_entries = WORD_ENTRY_XPATH(tree)
 
     for entry in word_entries:
         # Get the word representation
-        representation = entry.find('div', class_='concept_light-representation')
+        representation = REPRESENTATION_XPATH(entry)
         if not representation:
             continue
 
         # Find all meaning wrappers that contain sentences
         meaning_wrappers = []
-        for wrapper in entry.find_all('div', class_='meaning-wrapper'):
-            if not wrapper.find('div', class_='sentence'):
+        for wrapper in MEANING_WRAPPER_XPATH(entry):
+            if not SENTENCE_XPATH(wrapper):
                 continue
 
-
-            # Create a copy to modify
-            wrapper_copy = BeautifulSoup(str(wrapper), 'html.parser').find('div')
-
-            if not isinstance(wrapper_copy, bs_Tag_t):
-                print("wrapper_copy", type(wrapper_copy))
-                continue
+            # Each page tree is only read once, so the wrapper is cleaned in place
+            collapse_whitespace(wrapper)
 
             # Remove definition dividers if they exist
-            for divider in wrapper_copy.find_all('span', class_='meaning-definition-section_divider'):
-                divider.decompose()
+            for divider in DIVIDER_XPATH(wrapper):
+                divider.drop_tree()
 
             # Remove zero-width space spans
-            for zwsp in wrapper_copy.find_all('span', string='\u200b'):
-                zwsp.decompose()
+            for zwsp in [span for span in wrapper.iter('span') if bs4_string(span) == '\u200b']:
+                zwsp.drop_tree()
 
             # Remove supplemental_info spans
-            for supplemental_info in wrapper_copy.find_all('span', class_='supplemental_info'):
-                supplemental_info.decompose()
+            for supplemental_info in SUPPLEMENTAL_INFO_XPATH(wrapper):
+                supplemental_info.drop_tree()
 
             # Remove newlines while preserving HTML structure
-            wrapper_html = str(wrapper_copy).replace('\n', '')
+            wrapper_html = to_html(wrapper).replace('\n', '')
             meaning_wrappers.append(wrapper_html)
 
 
         # Only include entries that have meaning wrappers with sentences
         if meaning_wrappers:
-            representation_html = str(representation).replace('\n', '')
+            collapse_whitespace(representation[0])
+            representation_html = to_html(representation[0]).replace('\n', '')
             results.append({
                 'representation': representation_html,
                 'meaning_wrappers': meaning_wrappers
@@ -149,13 +191,13 @@ def extract_words_with_sentences(soup):
 
 def iterate_jisho_html_files(directory='jisho_pages'):
     """
-    Generator function that opens each HTML file in the directory and yields BeautifulSoup objects
+    Generator function that opens each HTML file in the directory and yields lxml.html documents
 
     Usage:
-    for soup, filename in iterate_jisho_html_files():
+    for tree, filename in iterate_jisho_html_files():
         # Your processing code here
         print(f"Processing {filename}")
-        print(soup.title)
+        print(tree.findtext('.//title'))
     """
     # Get all HTML files in the directory, sorted numerically
     files = sorted(
@@ -167,8 +209,8 @@ def iterate_jisho_html_files(directory='jisho_pages'):
         filepath = os.path.join(directory, filename)
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
-                soup = BeautifulSoup(f.read(), 'html.parser')
-                yield soup, filename
+                tree = lh.document_fromstring(f.read())
+                yield tree, filename
         except Exception as e:
             print(f"Error processing {filename}: {e}")
             continue
@@ -191,6 +233,9 @@ def store_extracted_results(results: List[List[Dict]], db_path: str = "jisho_wor
     all_entries = [entry for page in results for entry in page]
 
     with sqlite3.connect(db_path) as conn:
+        # WAL without syncing keeps the bulk load from fsyncing, a failed load is simply rerun
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
         c = conn.cursor()
 
         # Create tables with improved schema
@@ -201,39 +246,50 @@ def store_extracted_results(results: List[List[Dict]], db_path: str = "jisho_wor
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )""")
 
+        # Rows are clustered on (word_id, id), the order every reader walks them in,
+        # so a lookup by word_id or a full ordered scan never goes through a rowid
         c.execute("""
         CREATE TABLE IF NOT EXISTS meaning_wrappers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id INTEGER NOT NULL,
             word_id INTEGER NOT NULL,
             wrapper_html TEXT NOT NULL,
+            PRIMARY KEY(word_id, id),
             FOREIGN KEY(word_id) REFERENCES words(id) ON DELETE CASCADE
-        )""")
-
-        # Create index for faster queries
-        c.execute("""
-        CREATE INDEX IF NOT EXISTS idx_word_id ON meaning_wrappers(word_id)
-        """)
+        ) WITHOUT ROWID""")
 
         # Insert data in transaction
-        conn.execute("BEGIN TRANSACTION")
+        conn.execute("BEGIN IMMEDIATE")
         try:
+            # Hand out ids up front so each table loads with a single executemany,
+            # WITHOUT ROWID tables have no AUTOINCREMENT anyway
+            word_id = c.execute("SELECT COALESCE(MAX(id), 0) FROM words").fetchone()[0]
+            wrapper_id = c.execute("SELECT COALESCE(MAX(id), 0) FROM meaning_wrappers").fetchone()[0]
+            words = []
+            wrappers = []
             for entry in all_entries:
-                c.execute(
-                    "INSERT INTO words (representation_html) VALUES (?)",
-                    (entry['representation'],)
-                )
-                word_id = c.lastrowid
+                word_id += 1
+                words.append((word_id, entry['representation']))
 
                 for wrapper in entry['meaning_wrappers']:
-                    c.execute(
-                        "INSERT INTO meaning_wrappers (word_id, wrapper_html) VALUES (?, ?)",
-                        (word_id, wrapper)
-                    )
+                    wrapper_id += 1
+                    wrappers.append((wrapper_id, word_id, wrapper))
+
+            c.executemany(
+                "INSERT INTO words (id, representation_html) VALUES (?, ?)",
+                words
+            )
+            c.executemany(
+                "INSERT INTO meaning_wrappers (id, word_id, wrapper_html) VALUES (?, ?, ?)",
+                wrappers
+            )
             conn.commit()
         except:
             conn.rollback()
             raise
 
+        # Fold the WAL back into the database file so it can be opened read-only
+        conn.execute("PRAGMA journal_mode=DELETE")
+
     print(f"Stored {len(all_entries)} words in SQLite database: {db_path}")
 
 
@@ -273,9 +329,9 @@ def download_jisho_pages(base_url, end_page):
 if __name__ == "__main__":
     download_jisho_pages("https://jisho.org/search/%23jlpt-n1%20%23words?page=", 172)
     results = []
-    for soup, filename in iterate_jisho_html_files():
+    for tree, filename in iterate_jisho_html_files():
         print(f"--- Processing {filename} ---")
-        results.append(extract_words_with_sentences(soup))
+        results.append(extract_words_with_sentences(tree))
 
     create_combined_html(results)
     store_extracted_results(results)
@@ -2,27 +2,33 @@ import sqlite3
 import hashlib
 import zlib
 import json
+import orjson
 import base64
+import gzip
 from datetime import datetime, timedelta
+from functools import lru_cache
 import os
-from typing import List, Dict
+import random
+from typing import List, Dict, NamedTuple, Tuple
 
 import traceback
 import sys
 import asyncio
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, closing
 import logging
-import requests
+import httpx
 from pprint import pprint
 
 
-from fastapi import FastAPI, Request
+from fastapi import APIRouter, FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.exceptions import RequestValidationError
 from starlette.responses import FileResponse, Response, JSONResponse
 
-from draw import generate_word, generate_word_date
+# Shares draw's per-thread read-only connection, already tuned with
+# cache_size, mmap_size and temp_store pragmas
+from draw import generate_word, generate_word_date, get_connection
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -30,6 +36,62 @@ logging.basicConfig(level = logging.INFO)
 
 DB_PATH = os.path.join("data", "jisho_words.db")
 TRNML_HISTORY_PATH = os.path.join("data", "trmnl.json")
+DAILY_CACHE_PATH = os.path.join("data", "daily_cache.db")
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 3))
+
+# Preset deflate dictionary with the jisho markup every payload repeats, as it
+# appears after dump_words. Most common snippets go last so they sit closest to
+# the data. Must match ZDICT in www/index.html and trmnl-plugin-setting/shared.liquid.
+ZDICT = (
+    r'<ruby class=\"furigana-justify\"><rb></rb><rt></rt></ruby>'
+    r'<span class=\"kanji-2-up kanji\"></span><span class=\"kanji-1-up kanji\"></span>'
+    r'<span class=\"english\" lang=\"en\"></span></div></span></div>","'
+    r'<span class=\"sentences zero-padding\"><div class=\"sentence\" style=\"\">'
+    r'<ul class=\"japanese japanese_gothic clearfix\" lang=\"ja\">'
+    r'<span class=\"hit\"></span></span></li>。</ul>'
+    r'<div class=\"meaning-wrapper\"><div class=\"meaning-definition zero-padding\">'
+    r'<span class=\"meaning-meaning\"></span></div>'
+    r'["<div class=\"concept_light-representation\"><span class=\"furigana\">'
+    r'</span><span class=\"text\"><span></span></span></div>'
+    r'<li class=\"clearfix\"><span class=\"furigana\"></span><span class=\"unlinked\"></span></li>'
+).encode('utf-8')
+
+# Bump whenever the stored payload changes (word pick, JSON layout, ZDICT)
+# so init_daily_cache drops the stale rows. Rebuilding jisho_words.db needs no
+# bump, rows are keyed on the mtime the word pick was loaded with and rows of
+# an older file are never read.
+DAILY_CACHE_VERSION = 4
+
+def ensure_word_id_index():
+    """
+    Create an index on meaning_wrappers(word_id) unless one already leads
+    with that column. Databases from the current scraper have it as the
+    primary key, older ones may lack it. Safe to run on every startup.
+    """
+    try:
+        with closing(sqlite3.connect(f"file:{DB_PATH}?mode=rw", uri=True)) as conn, conn:
+            for index in conn.execute("PRAGMA index_list(meaning_wrappers)").fetchall():
+                columns = conn.execute(f'PRAGMA index_info("{index[1]}")').fetchall()
+                if columns and columns[0][2] == "word_id":
+                    return
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_meaning_wrappers_word_id ON meaning_wrappers(word_id)")
+            logger.info("[ensure_word_id_index] created ix_meaning_wrappers_word_id")
+    except sqlite3.Error as e:
+        logger.error(f"[ensure_word_id_index] {e}")
+
+@lru_cache(maxsize=1)
+def get_wrapper_counts() -> Tuple[int, Dict[int, int]]:
+    # Number of meaning wrappers of every word that has any, loaded once,
+    # with the mtime of jisho_words.db they were read from. The mtime is taken
+    # first, a rebuild in between only files rows under the stale key
+    source = os.stat(DB_PATH).st_mtime_ns
+    rows = get_connection().execute("""
+    SELECT word_id, COUNT(*)
+    FROM meaning_wrappers
+    GROUP BY word_id
+    ORDER BY word_id
+    """)
+    return source, {word_id: count for word_id, count in rows}
 
 def get_daily_meaning_wrappers(date_str: str = "") -> List[Dict]:
     """
@@ -40,10 +102,10 @@ def get_daily_meaning_wrappers(date_str: str = "") -> List[Dict]:
         date_str: Date string in YYYY-MM-DD format (defaults to today)
 
     Returns:
-        List of four entries with meaning wrappers and their words:
+        List of four entries with the word's representation followed by
+        its meaning wrapper:
         [{
-            'meaning_wrapper': html_str,
-            'representation': html_str,
+            'html': html_str,
             'word_id': int
         }, ...]
     """
@@ -51,207 +113,372 @@ def get_daily_meaning_wrappers(date_str: str = "") -> List[Dict]:
     if date_str == "":
         date_str = datetime.now().strftime("%Y-%m-%d")
 
-    # Connect to database
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = get_connection()
+
+    # Create consistent numeric seed from date string
+    date_seed = zlib.crc32(date_str.encode())
+
+    # Pick the four words and one wrapper offset for each in Python, so the
+    # query is a handful of primary key seeks
+    rng = random.Random(date_seed)
+    _, wrapper_counts = get_wrapper_counts()
+    word_ids = list(wrapper_counts)
+    daily_word_ids = sorted(rng.sample(word_ids, min(4, len(word_ids))))
+    offsets = [rng.randrange(wrapper_counts[word_id]) for word_id in daily_word_ids]
+
+    query = """
+    SELECT 
+        w.representation_html || mw.wrapper_html as html,
+        mw.word_id
+    FROM meaning_wrappers mw
+    JOIN words w ON mw.word_id = w.id
+    WHERE mw.word_id = ?
+    ORDER BY mw.id
+    LIMIT 1 OFFSET ?
+    """
 
-    try:
-        # Create consistent numeric seed from date string
-        date_seed = int(hashlib.sha256(date_str.encode()).hexdigest(), 16) % 2**31
-
-        # Query to get four random meaning wrappers with their words
-        query = """
-        WITH daily_words AS (
-            SELECT DISTINCT word_id
-            FROM meaning_wrappers
-            ORDER BY SUBSTR(word_id * ?, 1, 15)
-            LIMIT 4
-        ),
-        selected_wrappers AS (
-            SELECT 
-                mw.id,
-                mw.wrapper_html,
-                mw.word_id,
-                w.representation_html,
-                ROW_NUMBER() OVER (PARTITION BY mw.word_id ORDER BY SUBSTR(mw.id * ?, 1, 15)) as rn
-            FROM meaning_wrappers mw
-            JOIN words w ON mw.word_id = w.id
-            JOIN daily_words dw ON mw.word_id = dw.word_id
-        )
-        SELECT 
-            wrapper_html as meaning_wrapper,
-            representation_html as representation,
-            word_id
-        FROM selected_wrappers
-        WHERE rn = 1  -- Take just one wrapper per word
-        ORDER BY word_id
-        """
-
-        cursor = conn.cursor()
-        cursor.execute(query, (date_seed, date_seed))
-        rows = cursor.fetchall()
-
-        return [dict(row) for row in rows]
-
-    finally:
-        conn.close()
-
-def compress_text(text):
+    rows = []
+    for word_id, offset in zip(daily_word_ids, offsets):
+        rows.extend(conn.execute(query, (word_id, offset)))
+
+    return [dict(row) for row in rows]
+
+def compress_text(text_bytes, level=COMPRESS_LEVEL):
     """
-    Compresses a text string (including non-ASCII characters) and returns a compressed string.
+    Compresses UTF-8 encoded text and returns a compressed string.
 
     Args:
-        text (str): The input text to compress
+        text_bytes (bytes): The UTF-8 encoded text to compress
+        level (int): zlib compression level
 
     Returns:
         str: The compressed text as a base64-encoded string
     """
-    # Convert text to bytes (UTF-8 encoding handles all Unicode characters)
-    text_bytes = text.encode('utf-8')
-
-    # Compress the bytes using zlib
-    compressed_bytes = zlib.compress(text_bytes, level=zlib.Z_BEST_COMPRESSION)
+    # Compress the bytes using zlib, primed with the markup dictionary
+    compressor = zlib.compressobj(level, zdict=ZDICT)
+    compressed_bytes = compressor.compress(text_bytes) + compressor.flush()
 
     # Encode the compressed bytes as base64 for safe string representation
     compressed_text = base64.b64encode(compressed_bytes).decode('ascii')
 
     return compressed_text
 
-def get_4_daily_words() -> List[str]:
-    combined = []
-    words = get_daily_meaning_wrappers()
-    for i, word in enumerate(words, 1):
-        rawHTML = word["representation"] + word["meaning_wrapper"]
-        combined.append(rawHTML)
-    return combined
+def get_4_daily_words(date_str: str = "") -> List[str]:
+    words = get_daily_meaning_wrappers(date_str)
+    return [word["html"] for word in words]
+
+def dump_words(words: List[str]) -> bytes:
+    # Compact UTF-8 JSON, the Japanese text is kept as is instead of \uXXXX
+    # escapes which are a third of the size before compression
+    return orjson.dumps(words)
 
-def generate_payload_to_trmnl():
+def init_daily_cache():
+    """
+    Create the daily_cache table and make sure today's payloads are in it.
+    It lives in its own file since the word database is opened read-only.
+    """
+    with closing(sqlite3.connect(DAILY_CACHE_PATH)) as conn, conn:
+        if conn.execute("PRAGMA user_version").fetchone()[0] != DAILY_CACHE_VERSION:
+            conn.execute("DROP TABLE IF EXISTS daily_cache")
+            conn.execute(f"PRAGMA user_version = {DAILY_CACHE_VERSION}")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_cache (
+            date TEXT NOT NULL,
+            level INTEGER NOT NULL,
+            source INTEGER NOT NULL,
+            blob TEXT NOT NULL,
+            PRIMARY KEY (date, level, source)
+        ) WITHOUT ROWID
+        """)
+
+    warm_daily_cache(datetime.now().strftime("%Y-%m-%d"))
+
+def warm_daily_cache(date_str: str):
+    for level in (COMPRESS_LEVEL, zlib.Z_BEST_COMPRESSION):
+        get_compressed_words(date_str, level)
+
+    # Only today and tomorrow are ever asked for, keep yesterday for late clients
+    yesterday_str = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    with closing(sqlite3.connect(DAILY_CACHE_PATH)) as conn, conn:
+        conn.execute("DELETE FROM daily_cache WHERE date < ?", (yesterday_str,))
+
+def get_compressed_words(date_str: str, level: int) -> str:
+    """
+    Return the compressed words of a day from daily_cache, running the
+    selection and compression and storing the result on a miss.
+    """
+    # Same key the word pick below is made with, see get_wrapper_counts
+    source, _ = get_wrapper_counts()
+    with closing(sqlite3.connect(DAILY_CACHE_PATH)) as conn:
+        row = conn.execute(
+            "SELECT blob FROM daily_cache WHERE date = ? AND level = ? AND source = ?",
+            (date_str, level, source)).fetchone()
+        if row is not None:
+            return row[0]
+
+        words = get_4_daily_words(date_str)
+        rawJSON = dump_words(words)
+        compressedJSON = compress_text(rawJSON, level)
+
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO daily_cache (date, level, source, blob) VALUES (?, ?, ?, ?)",
+                (date_str, level, source, compressedJSON))
+        return compressedJSON
+
+@lru_cache(maxsize=4)
+def generate_payload_to_trmnl(date_str: str, level: int = COMPRESS_LEVEL):
+    """
+    Build the TRMNL payload for a day. The words only depend on the date,
+    so the result is cached and the key naturally rolls over at midnight.
+    """
     payload = {}
-    words = get_4_daily_words()
-    rawJSON = json.dumps(words)
-    compressedJSON = compress_text(rawJSON)
+    compressedJSON = get_compressed_words(date_str, level)
 
     payload['merge_variables'] = { "compressed": compressedJSON }
     # print(len(json.dumps(payload)))
     # print(payload)
     return payload
 
-def send_to_trmnl():
-    trnml_stat= {}
-    today_str = datetime.now().strftime("%Y-%m-%d")
+@lru_cache(maxsize=4)
+def generate_payload_json(date_str: str, level: int = COMPRESS_LEVEL) -> bytes:
+    # Serialized once per day instead of per request
+    return orjson.dumps(generate_payload_to_trmnl(date_str, level))
 
-    try:
-        TRMNL_API_KEY = os.environ['TRMNL_PLUGIN_API_KEY']
-    except KeyError:
-        logger.error("[send_to_trmnl] TRMNL_PLUGIN_API_KEY not set in environment variables.")
-        return
+@lru_cache(maxsize=4)
+def generate_payload_gzip(date_str: str, level: int = COMPRESS_LEVEL) -> bytes:
+    # Gzipped copy of the serialized payload for clients that accept it, made
+    # once per day so neither the handler nor GZipMiddleware redo the work
+    return gzip.compress(generate_payload_json(date_str, level), compresslevel=1)
 
-    if TRMNL_API_KEY is None:
-        return
+@lru_cache(maxsize=4)
+def generate_words_deflate(date_str: str, level: int = COMPRESS_LEVEL) -> bytes:
+    # Plain zlib stream of the words JSON, no base64 and no preset dictionary,
+    # so any HTTP client can decode it natively as Content-Encoding: deflate
+    rawJSON = dump_words(get_4_daily_words(date_str))
+    return zlib.compress(rawJSON, level)
+
+# Date of the last successful push, so the hourly check usually skips the file
+_LAST_SENT_DATE: str | None = None
 
+def load_trmnl_history() -> Dict:
     try:
         with open(TRNML_HISTORY_PATH, 'r') as file:
-            trnml_stat = json.load(file)
+            return json.load(file)
     except FileNotFoundError:
         pass
     except json.JSONDecodeError:
         logger.error(f"[send_to_trmnl] invalid JSON file '{TRNML_HISTORY_PATH}'")
     except Exception as e:
         logger.error(f"[send_to_trmnl] {traceback.format_exc()}")
+    return {}
+
+def save_trmnl_history(today_str: str):
+    with open(TRNML_HISTORY_PATH, "w") as fp:
+        json.dump({
+            "last_datatime": today_str,
+        }, fp, indent=2)
+
+# Blocking file, database and rendering work below runs in worker threads
+# through asyncio.to_thread so the event loop keeps serving requests
+async def send_to_trmnl(client: httpx.AsyncClient):
+    global _LAST_SENT_DATE
+    today_str = datetime.now().strftime("%Y-%m-%d")
 
-    if "last_datatime" in trnml_stat:
-        if trnml_stat["last_datatime"] == today_str:
-            logger.info("[send_to_trmnl] PASS")
-            return
+    try:
+        TRMNL_API_KEY = os.environ['TRMNL_PLUGIN_API_KEY']
+    except KeyError:
+        logger.error("[send_to_trmnl] TRMNL_PLUGIN_API_KEY not set in environment variables.")
+        return
 
-    payload = generate_payload_to_trmnl()
+    if TRMNL_API_KEY is None:
+        return
+
+    if _LAST_SENT_DATE != today_str:
+        # Only read the file when the date in memory is stale, another
+        # worker may have already pushed today
+        trnml_stat = await asyncio.to_thread(load_trmnl_history)
+        _LAST_SENT_DATE = trnml_stat.get("last_datatime")
+
+    if _LAST_SENT_DATE == today_str:
+        logger.info("[send_to_trmnl] PASS")
+        return
+
+    # The webhook payload is size capped, squeeze it as much as possible
+    payload = await asyncio.to_thread(generate_payload_to_trmnl, today_str, zlib.Z_BEST_COMPRESSION)
 
     url = "https://usetrmnl.com/api/custom_plugins/" + TRMNL_API_KEY
-    response = requests.post(url, json=payload)
+    response = await client.post(url, json=payload)
     logger.info(response)
     if response.status_code == 200:
-        with open(TRNML_HISTORY_PATH, "w") as fp:
-            json.dump({
-                "last_datatime": today_str,
-            }, fp, indent=2)
+        _LAST_SENT_DATE = today_str
+        await asyncio.to_thread(save_trmnl_history, today_str)
     else:
         logger.error(response.text)
 
-async def updater():
+def seconds_until_next_run() -> float:
+    # Wake a few minutes after midnight, or retry within the hour if today's
+    # push has not gone through yet
+    now = datetime.now()
+    if _LAST_SENT_DATE != now.strftime("%Y-%m-%d"):
+        return 3600
+    target = (now + timedelta(days=1)).replace(hour=0, minute=5, second=0, microsecond=0)
+    return (target - now).total_seconds()
+
+async def updater(client: httpx.AsyncClient):
+    # The first pass runs at startup to catch up on a missed day
     while True:
         try:
-            send_to_trmnl()
+            await send_to_trmnl(client)
+        except Exception as e:
+            logger.error(f"[updater] {traceback.format_exc()}")
+        try:
+            # Serialize today's /api/words response bodies ahead of the requests
+            today_str = datetime.now().strftime("%Y-%m-%d")
+            await asyncio.to_thread(generate_payload_gzip, today_str)
+        except Exception as e:
+            logger.error(f"[updater] {traceback.format_exc()}")
+        try:
+            # Have tomorrow's payloads ready before the first request of the day
+            tomorrow_str = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+            await asyncio.to_thread(warm_daily_cache, tomorrow_str)
         except Exception as e:
             logger.error(f"[updater] {traceback.format_exc()}")
-        await asyncio.sleep(3600)
+        await asyncio.sleep(seconds_until_next_run())
+
+class StaticFile(NamedTuple):
+    content: bytes
+    media_type: str
+    etag: str
+    cache_control: str
+
+def load_static_file(path: str, media_type: str, cache_control: str = "no-cache") -> StaticFile:
+    with open(path, 'rb') as fp:
+        content = fp.read()
+    return StaticFile(content, media_type, f'"{hashlib.md5(content).hexdigest()}"', cache_control)
+
+def static_response(request: Request, static: StaticFile) -> Response:
+    # Serve from memory and answer conditional GETs with 304 Not Modified
+    headers = {"ETag": static.etag, "Cache-Control": static.cache_control}
+    if_none_match = request.headers.get("if-none-match", "")
+    etags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if static.etag in etags or "*" in etags:
+        return Response(status_code=304, headers=headers)
+    return Response(content=static.content, media_type=static.media_type, headers=headers)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    task = asyncio.create_task(updater())
+    # The site is two files, read them once instead of on every request.
+    # index.html carries the ZDICT that /api/words is compressed with, so it
+    # is revalidated on every load, the ETag keeps that to a 304
+    app.state.index = await asyncio.to_thread(load_static_file, "www/index.html", "text/html; charset=utf-8")
+    # The favicon is a PNG, labelled as one GZipMiddleware leaves it uncompressed
+    app.state.favicon = await asyncio.to_thread(load_static_file, "www/favicon.png", "image/png", "public, max-age=3600")
+    await asyncio.to_thread(ensure_word_id_index)
+    try:
+        await asyncio.to_thread(init_daily_cache)
+    except Exception as e:
+        # Keep serving the site even when the word database is unusable
+        logger.error(f"[lifespan] {traceback.format_exc()}")
+    # One client for the app's lifetime so the connection to TRMNL is kept alive
+    app.state.http = httpx.AsyncClient(timeout=10)
+    task = asyncio.create_task(updater(app.state.http))
     yield  # Application runs here
     task.cancel()
+    await app.state.http.aclose()
 
 app = FastAPI(lifespan=lifespan)
-
-@app.middleware("http")
-async def strip_path_prefix(request: Request, call_next):
-    prefix = "/japanese"
-    prefix_len = len(prefix)
-    if request.url.path.startswith(prefix):
-        request.scope["path"] = request.scope["path"][prefix_len:]
-
-    response = await call_next(request)
-    return response
+# Added here rather than under __main__ so `uvicorn main:app` gets it too.
+# Level 1 keeps the extra pass cheap, small bodies like the base64 /api/words
+# payload are left alone and responses that already carry a Content-Encoding
+# (/api/words_raw) are passed through untouched.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=1)
 
 # Disable detailed validation errors in production
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     return Response(status_code=404)
 
-@app.get("/favicon.ico")
-async def favicon():
-    return FileResponse("www/favicon.png", media_type="image/x-icon")
+# Routes are served both at the root and under /japanese (see include_router below)
+router = APIRouter()
 
-@app.get("/")
-@app.get("/index.html")
-async def static_file(request: Request):
-    path = request.url.path
-    if path == '/':
-        path = '/index.html'
+@router.get("/favicon.ico")
+async def favicon(request: Request):
+    return static_response(request, request.app.state.favicon)
 
-    return FileResponse(f'www{path}')
+@router.get("/")
+@router.get("/index.html")
+async def static_file(request: Request):
+    return static_response(request, request.app.state.index)
 
 
-@app.get("/api/plot")
+@router.get("/api/plot")
 async def plot_file(width: int = 780, height: int = 460, word_id: int = 0):
-    path = generate_word(width, height, word_id)
+    path = await asyncio.to_thread(generate_word, width, height, word_id)
 
     return FileResponse(path, media_type="image/svg+xml")
 
-@app.get("/api/draw")
+@router.get("/api/draw")
 async def draw_file(width: int = 780, height: int = 460, date_str: str = "", offset: int = 0):
     if offset < 0 or offset > 3:
         return Response(status_code=404)
     try:
         datetime.strptime(date_str, '%Y%m%d')
-        path = generate_word_date(width, height, date_str, offset)
+        path = await asyncio.to_thread(generate_word_date, width, height, date_str, offset)
         return FileResponse(path, media_type="image/svg+xml")
     except ValueError:
         return Response(status_code=404)
 
 
 
-@app.get("/api/words")
-async def get_daily_words():
-    return JSONResponse(generate_payload_to_trmnl())
+def accepts_gzip(accept_encoding: str) -> bool:
+    # gzip is accepted when listed, or covered by "*", with a q-value above 0
+    qualities = {}
+    for entry in accept_encoding.split(","):
+        coding, *params = [part.strip() for part in entry.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+@router.get("/api/words")
+async def get_daily_words(request: Request):
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    headers = {"Vary": "Accept-Encoding"}
+    if accepts_gzip(request.headers.get("accept-encoding", "")):
+        content = await asyncio.to_thread(generate_payload_gzip, today_str)
+        headers["Content-Encoding"] = "gzip"
+    else:
+        content = await asyncio.to_thread(generate_payload_json, today_str)
+    return Response(content=content, media_type="application/json", headers=headers)
+
+@router.get("/api/words_raw")
+async def get_daily_words_raw():
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    content = await asyncio.to_thread(generate_words_deflate, today_str)
+    return Response(content=content, media_type="application/json", headers={"Content-Encoding": "deflate"})
+
+app.include_router(router)
+app.include_router(router, prefix="/japanese")
 
 if __name__ == '__main__':
-    app.add_middleware(GZipMiddleware, minimum_size=1000)
     import uvicorn
+    dev = bool(os.environ.get("DEV"))
     uvicorn.run("main:app",
                 port=80,
                 host='0.0.0.0',
-                reload=True,
-                log_level='debug',
-                workers=1)
+                # "auto" picks uvloop and httptools (uvicorn[standard]) when
+                # they are installed and falls back to asyncio/h11 otherwise
+                loop='auto',
+                http='auto',
+                reload=dev,
+                log_level='debug' if dev else 'info',
+                # Every worker runs its own updater, so one unless asked for more
+                workers=int(os.environ.get("WEB_CONCURRENCY", 1)))
 